@@ -46,6 +46,7 @@ CREATE TABLE IF NOT EXISTS expenses (
     status TEXT CHECK(status IN ('Pending', 'Approved', 'Rejected')) DEFAULT 'Pending',
     receipt_image TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fingerprint TEXT,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
     FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE SET NULL,
     FOREIGN KEY (method_id) REFERENCES payment_methods(method_id) ON DELETE SET NULL
@@ -62,10 +63,42 @@ CREATE TABLE IF NOT EXISTS audit_log (
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
+-- Expense shards (expense_report_shard<N>.db); empty means expenses are stored here
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id INTEGER PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Quantile sketches (t-digest) per user, category and month
+CREATE TABLE IF NOT EXISTS expense_sketches (
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    expense_count INTEGER NOT NULL CHECK(expense_count > 0),
+    total REAL NOT NULL,
+    min_amount REAL NOT NULL,
+    max_amount REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (user_id, category_id, month)
+);
+
+CREATE TABLE IF NOT EXISTS expense_rollups (
+    category_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    expense_count INTEGER NOT NULL CHECK(expense_count > 0),
+    total REAL NOT NULL,
+    min_amount REAL NOT NULL,
+    max_amount REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (category_id, month)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_fingerprint ON expenses(fingerprint);
 CREATE INDEX IF NOT EXISTS idx_expenses_user ON expenses(user_id);
 CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
 CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category_id);
 CREATE INDEX IF NOT EXISTS idx_expenses_status ON expenses(status);
 CREATE INDEX IF NOT EXISTS idx_expenses_method ON expenses(method_id);
+CREATE INDEX IF NOT EXISTS idx_expense_sketches_cell ON expense_sketches(category_id, month);
 
 COMMIT;
\ No newline at end of file
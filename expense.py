@@ -2,13 +2,460 @@ import sqlite3
 import bcrypt
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import bisect
 import getpass
+import hashlib
+import json
+import math
+import os
+import time
+import threading
 
 DB_PATH = "expense_report.db"
+SNAPSHOT_PATH = "expense_report_snapshot.db"
+
+# Online backup tuning: pages copied per step and pause between steps,
+# so writers can take the lock while a backup or snapshot is running
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.05
+# Attempts at a backup that is consistent with the shard map (see _backup_all)
+BACKUP_RETRIES = 3
+
+# When set, report_* functions read from this read-only snapshot instead
+# of the primary database
+REPORT_DB_PATH = None
+_snapshot_stop = None
+
+# Sharding: expenses live in <db>_shard<N>.db files, routed by user_id % N,
+# while users/categories/payment_methods stay in the catalog (DB_PATH).
+# Each shard hands out expense IDs from its own range of SHARD_ID_SPAN, so
+# expense_id // SHARD_ID_SPAN tells which shard holds a row.
+MAX_SHARDS = 10  # SQLite's default limit of attached databases
+SHARD_ID_SPAN = 10 ** 12
+# Attempts at routing a write while rebalances commit (see _open_shard_for_write)
+SHARD_ROUTING_RETRIES = 3
+EXPENSE_COLUMNS = ["user_id", "category_id", "method_id", "amount", "date", "description",
+                   "tag", "status", "receipt_image", "created_at", "fingerprint"]
+
+# Fields hashed into an expense's fingerprint, in argument order
+FINGERPRINT_COLUMNS = ["user_id", "date", "amount", "category_id", "method_id", "description"]
+FINGERPRINT_SQL = f"expense_fingerprint({', '.join(FINGERPRINT_COLUMNS)})"
+
+# Quantile sketches: a merging t-digest per (user, category, month) for
+# user reports, plus a rollup per (category, month) over every user of the
+# same database for admin reports, so those merge one rollup per shard rather
+# than every user's sketch. Both are kept next to the expenses they summarise.
+DIGEST_COMPRESSION = 200
+REPORT_QUANTILES = (0.5, 0.9, 0.99)
+
+# One statement per string, so the migration can run them inside its transaction
+SKETCH_SCHEMA = ("""
+CREATE TABLE IF NOT EXISTS {schema}.expense_sketches (
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    expense_count INTEGER NOT NULL CHECK(expense_count > 0),
+    total REAL NOT NULL,
+    min_amount REAL NOT NULL,
+    max_amount REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (user_id, category_id, month)
+);
+""", """
+CREATE INDEX IF NOT EXISTS {schema}.idx_expense_sketches_cell ON expense_sketches(category_id, month);
+""", """
+CREATE TABLE IF NOT EXISTS {schema}.expense_rollups (
+    category_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    expense_count INTEGER NOT NULL CHECK(expense_count > 0),
+    total REAL NOT NULL,
+    min_amount REAL NOT NULL,
+    max_amount REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (category_id, month)
+);
+""")
+
+# Key columns of each sketch table; the sketch columns follow them
+SKETCH_KEYS = {"expense_sketches": ("user_id", "category_id", "month"),
+               "expense_rollups": ("category_id", "month")}
+
+# Import modes for rows whose fingerprint is already stored
+IMPORT_MODES = ("skip", "upsert")
+# Columns outside the fingerprint that an "upsert" import may overwrite
+UPSERT_COLUMNS = ["tag", "status", "receipt_image"]
+
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    method_id INTEGER NOT NULL,
+    amount REAL NOT NULL CHECK(amount > 0),
+    date DATE NOT NULL,
+    description TEXT,
+    tag TEXT CHECK(length(tag) <= 20),
+    status TEXT CHECK(status IN ('Pending', 'Approved', 'Rejected')) DEFAULT 'Pending',
+    receipt_image TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fingerprint TEXT
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_fingerprint ON expenses(fingerprint);
+CREATE INDEX IF NOT EXISTS idx_expenses_user ON expenses(user_id);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category_id);
+CREATE INDEX IF NOT EXISTS idx_expenses_status ON expenses(status);
+CREATE INDEX IF NOT EXISTS idx_expenses_method ON expenses(method_id);
+""" + "".join(statement.format(schema="main") for statement in SKETCH_SCHEMA)
+
+# Tables stored in every shard; scatter-gather connections see each one as
+# a UNION ALL view over all shards
+SHARDED_TABLES = ("expenses", "expense_sketches", "expense_rollups")
+
+# Databases already brought up to the current schema (see _ensure_expense_schema)
+_prepared_paths = set()
+
+# Hash of the fields that identify an expense, used to detect duplicate rows
+def _expense_fingerprint(user_id, date, amount, category_id, method_id, description):
+    if None in (user_id, date, amount, category_id, method_id):
+        return None  # leave it to the NOT NULL constraints
+    key = "|".join([str(int(user_id)), str(date).strip(), f"{float(amount):.2f}",
+                    str(int(category_id)), str(int(method_id)), (description or "").strip()])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def _is_iso_date(value):
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').strftime('%Y-%m-%d') == str(value)
+    except ValueError:
+        return False
+
+# Month an expense is sketched under; None for dates not in YYYY-MM-DD form,
+# which older versions accepted. Also available in SQL as expense_month(date).
+def _expense_month(date):
+    return str(date)[:7] if _is_iso_date(date) else None
+
+def _connect(target):
+    conn = sqlite3.connect(target, uri=True)
+    conn.create_function("expense_fingerprint", 6, _expense_fingerprint, deterministic=True)
+    conn.create_function("expense_month", 1, _expense_month, deterministic=True)
+    return conn
+
+# Bring an expenses database created by an older version up to date.
+# Fingerprints: when old rows are identical, the lowest expense_id keeps the
+# fingerprint and the rest stay NULL, so the duplicate report (option 27) can
+# find them. Sketches: built once from the existing expenses, and rollups
+# from the existing sketches where a database already has those.
+# Uses its own connection: BEGIN IMMEDIATE takes the write lock on every
+# attached database, and the catalog must stay writable for other shards.
+def _ensure_expense_schema(path):
+    key = os.path.abspath(path)
+    if key in _prepared_paths:
+        return
+    conn = _connect(_sqlite_target(path, False, create=False))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(expenses)")]
+        if columns and "fingerprint" not in columns:
+            conn.execute("ALTER TABLE expenses ADD COLUMN fingerprint TEXT")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_fingerprint ON expenses(fingerprint)")
+            rows = conn.execute("""SELECT expense_id, user_id, date, amount, category_id, method_id, description
+                                   FROM expenses ORDER BY expense_id""").fetchall()
+            conn.executemany("UPDATE OR IGNORE expenses SET fingerprint = ? WHERE expense_id = ?",
+                             [(_expense_fingerprint(*row[1:]), row[0]) for row in rows])
+
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if columns and "expense_rollups" not in tables:
+            for statement in SKETCH_SCHEMA:
+                conn.execute(statement.format(schema="main"))
+            if "expense_sketches" in tables:
+                _rollup_rebuild(conn)
+            else:
+                _sketch_build(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _prepared_paths.add(key)
+
+# Merging t-digest over a list of [mean, weight] centroids. Neighbouring
+# centroids are combined while they span at most one unit of the arcsine
+# scale, which keeps centroids small near the tails (p99) and large near the
+# median.
+def _digest_scale(q, compression=DIGEST_COMPRESSION):
+    return compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+def _digest_compress(centroids, compression=DIGEST_COMPRESSION):
+    if not centroids:
+        return []
+    centroids = sorted(centroids)
+    total = sum(weight for _, weight in centroids)
+
+    merged = []
+    mean, weight = centroids[0]
+    weight_before = 0.0
+    k_left = _digest_scale(0.0, compression)
+    for next_mean, next_weight in centroids[1:]:
+        q_right = (weight_before + weight + next_weight) / total
+        if _digest_scale(q_right, compression) - k_left <= 1:
+            weight += next_weight
+            mean += (next_mean - mean) * next_weight / weight
+        else:
+            merged.append([mean, weight])
+            weight_before += weight
+            k_left = _digest_scale(weight_before / total, compression)
+            mean, weight = next_mean, next_weight
+    merged.append([mean, weight])
+    return merged
+
+# Piecewise-linear CDF through the centroid centres, pinned to min and max
+def _digest_points(centroids, min_value, max_value):
+    points = [(0.0, min_value)]
+    cumulative = 0.0
+    for mean, weight in centroids:
+        points.append((cumulative + weight / 2, mean))
+        cumulative += weight
+    points.append((cumulative, max_value))
+    return points
+
+def _digest_quantile(centroids, q, min_value, max_value):
+    points = _digest_points(centroids, min_value, max_value)
+    target = q * points[-1][0]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if target <= x1:
+            return y0 if x1 == x0 else y0 + (y1 - y0) * (target - x0) / (x1 - x0)
+    return max_value
+
+# Exact quantile using the same interpolation as _digest_quantile (each value
+# a centroid of weight 1), so exact mode measures only the sketch's error
+def _exact_quantile(amounts, q):
+    amounts = sorted(amounts)
+    return _digest_quantile([[amount, 1] for amount in amounts], q, amounts[0], amounts[-1])
+
+# Estimated number of values <= value
+def _digest_rank(centroids, value, min_value, max_value):
+    points = _digest_points(centroids, min_value, max_value)
+    if value < min_value:
+        return 0.0
+    if value >= max_value:
+        return points[-1][0]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if value < y1:
+            return x0 if y1 == y0 else x0 + (x1 - x0) * (value - y0) / (y1 - y0)
+    return points[-1][0]
+
+# Fold amounts into a stored sketch row (count, total, min, max, centroids)
+def _sketch_extend(sketch, amounts):
+    count, total, min_amount, max_amount, centroids = sketch or (0, 0.0, None, None, [])
+    amounts = [float(amount) for amount in amounts]
+    return (count + len(amounts), total + sum(amounts),
+            min(amounts + ([min_amount] if min_amount is not None else [])),
+            max(amounts + ([max_amount] if max_amount is not None else [])),
+            _digest_compress(centroids + [[amount, 1] for amount in amounts]))
+
+def _sketch_merge(sketches):
+    sketches = list(sketches)
+    return (sum(sketch[0] for sketch in sketches), sum(sketch[1] for sketch in sketches),
+            min(sketch[2] for sketch in sketches), max(sketch[3] for sketch in sketches),
+            _digest_compress([centroid for sketch in sketches for centroid in sketch[4]]))
+
+def _sketch_load(conn, table, key, schema="main"):
+    where = " AND ".join(f"{column} = ?" for column in SKETCH_KEYS[table])
+    row = conn.execute(f"""SELECT expense_count, total, min_amount, max_amount, digest
+                           FROM {schema}.{table} WHERE {where}""", key).fetchone()
+    return (*row[:4], json.loads(row[4])) if row else None
+
+def _sketch_save(conn, table, key, sketch, schema="main"):
+    count, total, min_amount, max_amount, centroids = sketch
+    placeholders = ", ".join("?" for _ in range(len(key) + 5))
+    conn.execute(f"INSERT OR REPLACE INTO {schema}.{table} VALUES ({placeholders})",
+                 (*key, count, total, min_amount, max_amount, json.dumps(centroids)))
+
+# Add new expense amounts, grouped by (user, category, month), to the user
+# sketches and to the (category, month) rollups
+def _sketch_add(conn, cells, schema="main"):
+    rollups = {}
+    for (user_id, category_id, month), amounts in cells.items():
+        rollups.setdefault((category_id, month), []).extend(amounts)
+    for table, groups in (("expense_sketches", cells), ("expense_rollups", rollups)):
+        for key, amounts in groups.items():
+            sketch = _sketch_load(conn, table, key, schema)
+            _sketch_save(conn, table, key, _sketch_extend(sketch, amounts), schema)
+
+# Recompute sketches from the expenses themselves, for cells where amounts
+# were changed or removed (a t-digest cannot subtract values)
+def _sketch_rebuild(conn, cells):
+    cells = set(cell for cell in cells if cell and cell[2])
+    for user_id, category_id, month in cells:
+        conn.execute("DELETE FROM main.expense_sketches WHERE user_id = ? AND category_id = ? AND month = ?",
+                     (user_id, category_id, month))
+        amounts = [row[0] for row in conn.execute("""SELECT amount FROM main.expenses
+                                                     WHERE user_id = ? AND category_id = ?
+                                                     AND expense_month(date) = ?""",
+                                                  (user_id, category_id, month))]
+        if amounts:
+            _sketch_save(conn, "expense_sketches", (user_id, category_id, month), _sketch_extend(None, amounts))
+    _rollup_rebuild(conn, set((category_id, month) for _, category_id, month in cells))
+
+# Recompute (category, month) rollups by merging the user sketches, for the
+# given keys or, by default, all of them
+def _rollup_rebuild(conn, keys=None, schema="main"):
+    if keys is None:
+        conn.execute(f"DELETE FROM {schema}.expense_rollups")
+        keys = conn.execute(f"SELECT DISTINCT category_id, month FROM {schema}.expense_sketches").fetchall()
+    for category_id, month in keys:
+        sketches = [(*row[:4], json.loads(row[4])) for row in conn.execute(
+            f"""SELECT expense_count, total, min_amount, max_amount, digest FROM {schema}.expense_sketches
+                WHERE category_id = ? AND month = ?""", (category_id, month))]
+        if sketches:
+            _sketch_save(conn, "expense_rollups", (category_id, month), _sketch_merge(sketches), schema)
+        else:
+            conn.execute(f"DELETE FROM {schema}.expense_rollups WHERE category_id = ? AND month = ?",
+                         (category_id, month))
+
+# Add expenses with expense_id > after_id (all of them by default) to the sketches
+def _sketch_build(conn, schema="main", after_id=0):
+    cells = {}
+    for user_id, category_id, month, amount in conn.execute(
+            f"""SELECT user_id, category_id, expense_month(date), amount
+                FROM {schema}.expenses WHERE expense_id > ?""", (after_id,)):
+        if month is None:
+            continue  # legacy date the sketches cannot place in a month
+        cells.setdefault((user_id, category_id, month), []).append(amount)
+    _sketch_add(conn, cells, schema)
+
+def _expense_cell(cursor, expense_id):
+    cursor.execute("SELECT user_id, category_id, expense_month(date) FROM expenses WHERE expense_id = ?",
+                   (expense_id,))
+    return cursor.fetchone()
+
+# The expense holding fingerprint was deleted or now has another one: hand it
+# to the lowest remaining identical expense (found through the unique index,
+# which also holds the NULLs) so imports keep skipping that row
+def _fingerprint_handover(cursor, fingerprint):
+    if fingerprint is None:
+        return
+    cursor.execute(f"""UPDATE expenses SET fingerprint = ?
+                       WHERE expense_id = (SELECT MIN(expense_id) FROM expenses
+                                           WHERE fingerprint IS NULL AND {FINGERPRINT_SQL} = ?)""",
+                   (fingerprint, fingerprint))
 
-# Database Connection
+# Database Connection (catalog: users, categories, payment methods)
 def connect_db():
-    return sqlite3.connect(DB_PATH)
+    return _connect(DB_PATH)
+
+def _shard_path(shard_id, base_path=DB_PATH):
+    root, ext = os.path.splitext(base_path)
+    return f"{root}_shard{shard_id}{ext or '.db'}"
+
+def _shard_count(conn):
+    try:
+        return conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0  # catalog created before sharding: expenses are stored in it
+
+# Current shard map of the catalog as (shard count, version); rebalancing
+# bumps the version, kept in the catalog's user_version
+def _shard_map(catalog_path=DB_PATH):
+    conn = _connect(catalog_path)
+    try:
+        return _shard_count(conn), conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+# With create=False a missing file is an error instead of a new empty
+# database, so a shard removed by a rebalance is not brought back
+def _sqlite_target(path, read_only, create=True):
+    if read_only:
+        return f"file:{path}?mode=ro"
+    return path if create else f"file:{path}?mode=rw"
+
+def _open_shard(catalog_path, shard_id, read_only=False):
+    shard_path = _shard_path(shard_id, catalog_path)
+    if not read_only:
+        _ensure_expense_schema(shard_path)
+    conn = _connect(_sqlite_target(shard_path, read_only, create=False))
+    # Unqualified users/categories/payment_methods resolve to the catalog
+    conn.execute("ATTACH DATABASE ? AS catalog", (_sqlite_target(catalog_path, read_only),))
+    return conn
+
+# Open the database holding user_id's expenses, or with user_id=None a
+# scatter-gather connection where each of SHARDED_TABLES is a UNION ALL view over every
+# shard, so ordering and aggregation are merged by SQLite itself.
+def _open_expense_db(catalog_path, user_id=None, read_only=False):
+    conn = _connect(_sqlite_target(catalog_path, read_only))
+    shard_count = _shard_count(conn)
+    if shard_count == 0:
+        if not read_only:
+            _ensure_expense_schema(catalog_path)
+        return conn
+
+    if user_id is not None:
+        conn.close()
+        return _open_shard(catalog_path, int(user_id) % shard_count, read_only)
+
+    for shard_id in range(shard_count):
+        shard_path = _shard_path(shard_id, catalog_path)
+        if not read_only:
+            _ensure_expense_schema(shard_path)
+        conn.execute(f"ATTACH DATABASE ? AS shard{shard_id}",
+                     (_sqlite_target(shard_path, read_only, create=False),))
+    for table in SHARDED_TABLES:
+        selects = [f"SELECT * FROM shard{shard_id}.{table}" for shard_id in range(shard_count)]
+        conn.execute(f"CREATE TEMP VIEW {table} AS " + " UNION ALL ".join(selects))
+    return conn
+
+# Open the expenses database that route(shard_count) picks (the catalog
+# before sharding) with its write lock held. The shard map is read before the
+# lock is taken, so a rebalance committed in between would send the write to
+# a shard the user no longer maps to, or to one about to be removed. With the
+# lock held no rebalance can commit (it writes every shard), so the catalog's
+# user_version is read again and on a change the shard is picked anew.
+def _open_shard_for_write(route):
+    for attempt in range(SHARD_ROUTING_RETRIES):
+        shard_count, shard_version = _shard_map()
+        conn = None
+        try:
+            if shard_count == 0:
+                _ensure_expense_schema(DB_PATH)
+                conn, catalog = _connect(DB_PATH), "main"
+            else:
+                conn, catalog = _open_shard(DB_PATH, route(shard_count)), "catalog"
+            # A no-op write takes the write lock on this file alone, where
+            # BEGIN IMMEDIATE would lock the attached catalog as well
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM main.expenses WHERE 0")
+            if conn.execute(f"PRAGMA {catalog}.user_version").fetchone()[0] == shard_version:
+                return conn
+        except sqlite3.OperationalError:
+            if conn is not None:
+                conn.close()
+            if _shard_map()[1] == shard_version:
+                raise
+            continue  # the shard was removed by that rebalance
+        conn.close()
+    raise sqlite3.OperationalError("shards kept being rebalanced; try again later")
+
+# Expenses Connection (one user's shard, or all shards when user_id is None);
+# for_write opens user_id's shard with its write lock held
+def connect_expenses(user_id=None, for_write=False):
+    if for_write:
+        return _open_shard_for_write(lambda shard_count: int(user_id) % shard_count)
+    return _open_expense_db(DB_PATH, user_id)
+
+# Expenses Connection for the shard holding expense_id, with its write lock held
+def connect_expense_by_id(expense_id):
+    return _open_shard_for_write(
+        lambda shard_count: min(max(int(expense_id) // SHARD_ID_SPAN, 0), shard_count - 1))
+
+# Reporting Connection (read-only snapshot when enabled)
+def connect_report_db(user_id=None):
+    if REPORT_DB_PATH and os.path.exists(REPORT_DB_PATH):
+        return _open_expense_db(REPORT_DB_PATH, user_id, read_only=True)
+    return connect_expenses(user_id)
 
 # 1. Create User (Admin Only)
 def create_user(admin_id, username, password, role="User"):
@@ -137,24 +584,40 @@ def add_expense(user_id, category_id, method_id, amount, date, description=None,
     if amount <= 0:
         print("Error: Amount must be greater than zero.")
         return
+    if not _is_iso_date(date):
+        print("Error: Date must be in YYYY-MM-DD format.")
+        return
 
-    conn = connect_db()
+    conn = connect_expenses(user_id, for_write=True)
     cursor = conn.cursor()
     
     try:
-        cursor.execute("""INSERT INTO expenses (user_id, category_id, method_id, amount, date, description, tag) 
-                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                      (user_id, category_id, method_id, amount, date, description, tag))
+        # Identical purchases are allowed: only the first one holds the
+        # fingerprint, so imports skip it and option 27 lists the others
+        fingerprint = _expense_fingerprint(user_id, date, amount, category_id, method_id, description)
+        cursor.execute("SELECT expense_id FROM expenses WHERE fingerprint = ?", (fingerprint,))
+        identical = cursor.fetchone()
+        if identical:
+            fingerprint = None
+        cursor.execute("""INSERT INTO expenses (user_id, category_id, method_id, amount, date, description, tag, fingerprint) 
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (user_id, category_id, method_id, amount, date, description, tag, fingerprint))
+        _sketch_add(conn, {(user_id, category_id, _expense_month(date)): [amount]})
         conn.commit()
         print("Expense added successfully!")
-    except sqlite3.IntegrityError:
-        print("Error: Invalid category ID or payment method ID.")
+        if identical:
+            print(f"Note: identical to expense {identical[0]}; it is listed by the duplicate scan (option 27).")
+    except sqlite3.IntegrityError as e:
+        if "fingerprint" in str(e):
+            print("Error: An identical expense was saved at the same time. Please try again.")
+        else:
+            print("Error: Invalid category ID or payment method ID.")
     finally:
         conn.close()
 
 # 10. Update Expense
 def update_expense(user_id, user_role, expense_id, field, new_value):
-    conn = connect_db()
+    conn = connect_expense_by_id(expense_id)
     cursor = conn.cursor()
 
     # Validate expense belongs to user (unless admin)
@@ -180,24 +643,47 @@ def update_expense(user_id, user_role, expense_id, field, new_value):
         elif field == 'category_id' or field == 'method_id':
             new_value = int(new_value)
         elif field == 'date':
-            datetime.strptime(new_value, '%Y-%m-%d')  # Validate date format
+            if not _is_iso_date(new_value):
+                raise ValueError("Date must be in YYYY-MM-DD format.")
 
+        old_cell = _expense_cell(cursor, expense_id)
+        cursor.execute("SELECT fingerprint FROM expenses WHERE expense_id = ?", (expense_id,))
+        old_fingerprint = (cursor.fetchone() or [None])[0]
         cursor.execute(f"UPDATE expenses SET {field} = ? WHERE expense_id = ?", 
                       (new_value, expense_id))
 
         if cursor.rowcount == 0:
             print("Error: Expense ID not found.")
         else:
+            if field in FINGERPRINT_COLUMNS:
+                # As in add_expense, an identical expense leaves this one without a fingerprint
+                cursor.execute(f"SELECT {FINGERPRINT_SQL} FROM expenses WHERE expense_id = ?", (expense_id,))
+                fingerprint = cursor.fetchone()[0]
+                cursor.execute("SELECT 1 FROM expenses WHERE fingerprint = ? AND expense_id != ?",
+                              (fingerprint, expense_id))
+                if cursor.fetchone():
+                    fingerprint = None
+                cursor.execute("UPDATE expenses SET fingerprint = ? WHERE expense_id = ?",
+                              (fingerprint, expense_id))
+                if fingerprint != old_fingerprint:
+                    _fingerprint_handover(cursor, old_fingerprint)
+            if field in ('amount', 'category_id', 'date'):
+                _sketch_rebuild(conn, [old_cell, _expense_cell(cursor, expense_id)])
             conn.commit()
             print("Expense updated successfully!")
     except ValueError as e:
         print(f"Error: Invalid value for field {field}. {str(e)}")
+    except sqlite3.IntegrityError as e:
+        if "fingerprint" in str(e):
+            print("Error: An identical expense was saved at the same time. Please try again.")
+        else:
+            print(f"Error: Invalid value for field {field}.")
     finally:
         conn.close()
 
 # 11. Delete Expense
 def delete_expense(user_id, user_role, expense_id):
-    conn = connect_db()
+    conn = connect_expense_by_id(expense_id)
     cursor = conn.cursor()
 
     # Validate ownership (unless Admin)
@@ -209,11 +695,16 @@ def delete_expense(user_id, user_role, expense_id):
             conn.close()
             return
 
+    cell = _expense_cell(cursor, expense_id)
+    cursor.execute("SELECT fingerprint FROM expenses WHERE expense_id = ?", (expense_id,))
+    fingerprint = (cursor.fetchone() or [None])[0]
     cursor.execute("DELETE FROM expenses WHERE expense_id = ?", (expense_id,))
     
     if cursor.rowcount == 0:
         print("Error: Expense ID not found.")
     else:
+        _fingerprint_handover(cursor, fingerprint)
+        _sketch_rebuild(conn, [cell])
         conn.commit()
         print("Expense deleted successfully!")
 
@@ -221,7 +712,7 @@ def delete_expense(user_id, user_role, expense_id):
 
 # 12. List Expenses with Filters
 def list_expenses(user_id, user_role, filters=None):
-    conn = connect_db()
+    conn = connect_expenses(None if user_role == "Admin" else user_id)
     
     base_query = """SELECT e.expense_id, e.amount, c.name as category, 
                    p.name as payment_method, e.date, e.description, e.tag
@@ -264,7 +755,7 @@ def list_expenses(user_id, user_role, filters=None):
 
 # 13. Export Expenses to CSV with Sorting
 def export_expenses(filename, sort_field=None):
-    conn = connect_db()
+    conn = connect_expenses()
     
     query = """SELECT e.expense_id, e.user_id, e.amount, c.name as category, 
               p.name as payment_method, e.date, e.description, e.tag
@@ -280,17 +771,122 @@ def export_expenses(filename, sort_field=None):
     conn.close()
     print(f"Expenses exported to {filename}" + (f" sorted by {sort_field}" if sort_field else ""))
 
+# Map the category/payment_method names written by export_expenses back to IDs
+def _resolve_import_ids(df, conn):
+    if "category_id" not in df.columns and "category" in df.columns:
+        categories = dict(conn.execute("SELECT name, category_id FROM categories").fetchall())
+        df["category_id"] = df.pop("category").map(categories)
+    if "method_id" not in df.columns and "payment_method" in df.columns:
+        methods = dict(conn.execute("SELECT name, method_id FROM payment_methods").fetchall())
+        df["method_id"] = df.pop("payment_method").map(methods)
+    return df
+
+# Bulk insert rows in one transaction; rows whose fingerprint is already stored
+# are skipped, or in "upsert" mode have their UPSERT_COLUMNS refreshed (which
+# leaves the sketches untouched). Returns the number of rows inserted or
+# changed, or None without writing anything when the shard map is no longer
+# shard_version (see _open_shard_for_write).
+def _write_import_rows(conn, columns, rows, mode, shard_version):
+    update_columns = [column for column in UPSERT_COLUMNS if column in columns]
+    if mode == "upsert" and update_columns:
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+        changed = " OR ".join(f"expenses.{column} IS NOT excluded.{column}" for column in update_columns)
+        conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        conflict = "DO NOTHING"
+
+    # Take the write lock first so expense_id > last_id is exactly the new
+    # rows, and so no rebalance can commit before this batch does
+    conn.execute("BEGIN IMMEDIATE")
+    if _shard_map()[1] != shard_version:
+        conn.rollback()
+        return None
+    last_id = conn.execute("SELECT COALESCE(MAX(expense_id), 0) FROM main.expenses").fetchone()[0]
+    before = conn.total_changes
+    conn.executemany(f"""INSERT INTO expenses ({', '.join(columns)})
+                         VALUES ({', '.join('?' for _ in columns)})
+                         ON CONFLICT(fingerprint) {conflict}""", rows)
+    written = conn.total_changes - before
+    _sketch_build(conn, after_id=last_id)
+    conn.commit()
+    return written
+
+def _import_into_shard(shard_path, shard_version, columns, rows, mode):
+    try:
+        _ensure_expense_schema(shard_path)
+        # Shard-only connection: with the catalog attached, BEGIN IMMEDIATE would
+        # lock it too and the shards could no longer be written in parallel
+        conn = _connect(_sqlite_target(shard_path, False, create=False))
+    except sqlite3.OperationalError:
+        if _shard_map()[1] == shard_version:
+            raise
+        return None  # the shard was removed by a rebalance
+    try:
+        return _write_import_rows(conn, columns, rows, mode, shard_version)
+    finally:
+        conn.close()
+
 # 14. Import Expenses from CSV
-def import_expenses(filename):
+def import_expenses(filename, mode="skip"):
+    if mode not in IMPORT_MODES:
+        print(f"Error: Invalid import mode. Must be one of: {', '.join(IMPORT_MODES)}")
+        return
+
     try:
         df = pd.read_csv(filename)
-        if "expense_id" in df.columns:
-            df.drop(columns=["expense_id"], inplace=True)
 
         conn = connect_db()
-        df.to_sql("expenses", conn, if_exists="append", index=False)
+        df = _resolve_import_ids(df, conn)
+        shard_count = _shard_count(conn)
         conn.close()
-        print(f"Expenses imported successfully from {filename}!")
+
+        # expense_id is dropped: the target database assigns new IDs
+        columns = [column for column in EXPENSE_COLUMNS if column in df.columns and column != "fingerprint"]
+        records = df[columns].astype(object).where(df[columns].notna(), None)
+
+        if "date" in columns:
+            # Line numbers count the header as line 1
+            bad_lines = [str(line) for line, date in enumerate(records["date"], start=2) if not _is_iso_date(date)]
+            if bad_lines:
+                print("Error: Dates must be in YYYY-MM-DD format (CSV line(s) "
+                      + ", ".join(bad_lines[:10]) + (", ..." if len(bad_lines) > 10 else "")
+                      + "). Nothing was imported.")
+                return
+        rows = []
+        for record in records.itertuples(index=False, name=None):
+            values = dict(zip(columns, record))
+            fingerprint = _expense_fingerprint(*(values.get(column) for column in FINGERPRINT_COLUMNS))
+            rows.append(record + (fingerprint,))
+        columns.append("fingerprint")
+
+        if shard_count and "user_id" not in columns:
+            print("Error: A user_id column is required to import into sharded storage.")
+            return
+
+        written = 0
+        pending = rows
+        for attempt in range(SHARD_ROUTING_RETRIES):
+            shard_count, shard_version = _shard_map()
+            batches = {}
+            for row in pending:
+                path = _shard_path(int(row[columns.index("user_id")]) % shard_count) if shard_count else DB_PATH
+                batches.setdefault(path, []).append(row)
+            # Each shard is a separate file with its own write lock, so the
+            # per-shard batches are written in parallel
+            with ThreadPoolExecutor(max_workers=max(shard_count, 1)) as pool:
+                futures = {path: pool.submit(_import_into_shard, path, shard_version, columns, batch, mode)
+                           for path, batch in batches.items()}
+            # Batches that found the shard map changed are routed again
+            pending = [row for path, future in futures.items() if future.result() is None
+                       for row in batches[path]]
+            written += sum(future.result() or 0 for future in futures.values())
+            if not pending:
+                break
+        else:
+            raise sqlite3.OperationalError("shards kept being rebalanced during the import; try again later")
+
+        print(f"Expenses imported successfully from {filename}! "
+              f"{written} row(s) written, {len(rows) - written} duplicate(s) left unchanged.")
     except FileNotFoundError:
         print(f"Error: File {filename} not found!")
     except sqlite3.IntegrityError as e:
@@ -300,7 +896,7 @@ def import_expenses(filename):
 
 # 16. Report Top N Expenses in Date Range
 def report_top_expenses(user_id, user_role, n, start_date=None, end_date=None):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     base_query = """SELECT e.expense_id, e.amount, c.name as category, 
                    p.name as payment_method, e.date, e.description
@@ -339,7 +935,7 @@ def report_top_expenses(user_id, user_role, n, start_date=None, end_date=None):
 
 # 17. Report Category Spending
 def report_category_spending(user_id, user_role, category_name):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     query = """SELECT SUM(e.amount) as total_spending
                FROM expenses e
@@ -362,7 +958,7 @@ def report_category_spending(user_id, user_role, category_name):
 
 # 18. Report Expenses Above Category Average
 def report_above_average_expenses(user_id, user_role):
-    conn = connect_db()
+    conn = connect_report_db()
     
     query = """SELECT e.expense_id, e.amount, c.name as category, e.date, e.description
                FROM expenses e
@@ -390,7 +986,7 @@ def report_above_average_expenses(user_id, user_role):
 
 # 19. Report Monthly Category Spending
 def report_monthly_category_spending(user_id, user_role):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     query = """SELECT strftime('%Y-%m', e.date) as month, 
                       c.name as category, 
@@ -416,7 +1012,7 @@ def report_monthly_category_spending(user_id, user_role):
 
 # 20. Report Highest Spender Per Month (Admin only)
 def report_highest_spender_per_month():
-    conn = connect_db()
+    conn = connect_report_db()
     
     query = """SELECT month, username, max_spending FROM (
                  SELECT strftime('%Y-%m', e.date) as month,
@@ -438,7 +1034,7 @@ def report_highest_spender_per_month():
 
 # 21. Report Most Frequent Category
 def report_frequent_category(user_id, user_role):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     query = """SELECT c.name as category, COUNT(*) as expense_count
                FROM expenses e
@@ -463,7 +1059,7 @@ def report_frequent_category(user_id, user_role):
 
 # 22. Report Payment Method Usage
 def report_payment_method_usage(user_id, user_role):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     query = """SELECT p.name as payment_method, 
                       COUNT(*) as transaction_count,
@@ -486,7 +1082,7 @@ def report_payment_method_usage(user_id, user_role):
 
 # 23. Report Expenses by Tag
 def report_tag_expenses(user_id, user_role):
-    conn = connect_db()
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
     
     query = """SELECT e.tag, COUNT(*) as expense_count,
                       SUM(e.amount) as total_spent
@@ -506,6 +1102,389 @@ def report_tag_expenses(user_id, user_role):
     print("\nExpenses by tag:")
     print(df.to_string(index=False) if not df.empty else print("No tagged expenses found"))
 
+# Copy src_path into dest_path with the online backup API.
+# Pages are copied in small steps with a pause in between so the CLI can keep
+# writing; the copy goes to a temp file first so readers never see a torn file.
+def _online_backup(src_path, dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    tmp_path = dest_path + ".tmp"
+    # Read-only, so a shard removed by a rebalance is an error rather than a new empty file
+    src = _connect(_sqlite_target(src_path, read_only=True))
+    dst = sqlite3.connect(tmp_path)
+    start = time.perf_counter()
+    try:
+        src.backup(dst, pages=pages, sleep=sleep)
+        page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+    except Exception:
+        dst.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp_path, dest_path)
+    elapsed = time.perf_counter() - start
+    return page_size * page_count, elapsed
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Copy the catalog and every shard next to dest_path (<dest>_shard<N>.db).
+# The files are copied one by one, so a rebalance committed in between would
+# leave users in two shards or none. Rebalancing bumps the catalog's
+# user_version; if the copied catalog's version differs from the one read
+# before the shards were copied, the staged copies are discarded and the
+# backup starts again. Shards are moved into place first so a reader never
+# finds a catalog pointing at missing shards.
+def _backup_all(dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    # Bring the databases up to the current schema first: snapshots are opened
+    # read-only, so the reports could not add fingerprints or sketches later
+    connect_expenses().close()
+
+    staged_path = dest_path + ".staged"
+    for attempt in range(BACKUP_RETRIES):
+        shard_count, shard_version = _shard_map()
+        staged = [_shard_path(shard_id, staged_path) for shard_id in range(shard_count)] + [staged_path]
+        # Counted per attempt, so the reported rate covers only the copy kept
+        total_bytes, elapsed = 0, 0.0
+
+        try:
+            for shard_id in range(shard_count):
+                shard_bytes, shard_elapsed = _online_backup(_shard_path(shard_id), staged[shard_id],
+                                                            pages, sleep)
+                total_bytes += shard_bytes
+                elapsed += shard_elapsed
+            catalog_bytes, catalog_elapsed = _online_backup(DB_PATH, staged_path, pages, sleep)
+            total_bytes += catalog_bytes
+            elapsed += catalog_elapsed
+
+            copy = sqlite3.connect(staged_path)
+            copied_version = copy.execute("PRAGMA user_version").fetchone()[0]
+            copy.close()
+        except Exception as e:
+            _remove_files(staged)
+            if isinstance(e, sqlite3.OperationalError) and _shard_map()[1] != shard_version:
+                continue  # a shard being copied was removed by that rebalance
+            raise
+
+        if copied_version == shard_version:
+            for shard_id in range(shard_count):
+                os.replace(staged[shard_id], _shard_path(shard_id, dest_path))
+            os.replace(staged_path, dest_path)
+            return total_bytes, elapsed
+        _remove_files(staged)
+
+    raise sqlite3.OperationalError("shards kept being rebalanced during the backup; try again later")
+
+def _print_backup_stats(label, total_bytes, elapsed):
+    rate = total_bytes / elapsed if elapsed > 0 else float(total_bytes)
+    print(f"{label}: {total_bytes} bytes in {elapsed:.2f}s ({rate:,.0f} bytes/sec)")
+
+# 24. Online Backup (Admin only)
+def backup_database(filename, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    if os.path.abspath(filename) == os.path.abspath(DB_PATH):
+        print("Error: Backup file must be different from the database file.")
+        return
+    try:
+        total_bytes, elapsed = _backup_all(filename, pages, sleep)
+        _print_backup_stats(f"Database backed up to {filename}", total_bytes, elapsed)
+    except sqlite3.Error as e:
+        print(f"Backup failed: {e}")
+
+# 25. Read-only Reporting Snapshot (Admin only)
+def refresh_snapshot(snapshot_path=SNAPSHOT_PATH, quiet=False):
+    global REPORT_DB_PATH
+    try:
+        total_bytes, elapsed = _backup_all(snapshot_path)
+    except sqlite3.Error as e:
+        if not quiet:
+            print(f"Snapshot refresh failed: {e}")
+        return
+    REPORT_DB_PATH = snapshot_path
+    if not quiet:
+        _print_backup_stats(f"Reporting snapshot refreshed at {snapshot_path}", total_bytes, elapsed)
+
+def _snapshot_loop(snapshot_path, interval, stop_event):
+    while not stop_event.wait(interval):
+        refresh_snapshot(snapshot_path, quiet=True)
+
+def start_snapshot_refresher(interval_minutes, snapshot_path=SNAPSHOT_PATH):
+    global _snapshot_stop
+    stop_snapshot_refresher()
+    refresh_snapshot(snapshot_path)
+    _snapshot_stop = threading.Event()
+    thread = threading.Thread(target=_snapshot_loop,
+                              args=(snapshot_path, interval_minutes * 60, _snapshot_stop),
+                              daemon=True)
+    thread.start()
+    print(f"Snapshot will be refreshed every {interval_minutes:g} minute(s).")
+
+def stop_snapshot_refresher():
+    global _snapshot_stop
+    if _snapshot_stop is not None:
+        _snapshot_stop.set()
+        _snapshot_stop = None
+
+def disable_snapshot_reports():
+    global REPORT_DB_PATH
+    stop_snapshot_refresher()
+    REPORT_DB_PATH = None
+    print("Reports now read from the primary database.")
+
+def _create_shard(shard_id):
+    conn = sqlite3.connect(_shard_path(shard_id))
+    try:
+        conn.executescript(SHARD_SCHEMA)
+        # Seed AUTOINCREMENT so this shard hands out IDs from its own range
+        conn.execute("""INSERT INTO sqlite_sequence (name, seq)
+                        SELECT 'expenses', ? WHERE NOT EXISTS
+                        (SELECT 1 FROM sqlite_sequence WHERE name = 'expenses')""",
+                     (shard_id * SHARD_ID_SPAN,))
+        conn.commit()
+    finally:
+        conn.close()
+
+# 26. Rebalance Expense Shards (Admin only)
+def rebalance_shards(admin_id, shard_count):
+    if not 1 <= shard_count <= MAX_SHARDS:
+        print(f"Error: Shard count must be between 1 and {MAX_SHARDS}.")
+        return
+
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT role FROM users WHERE user_id = ?", (admin_id,))
+    admin = cursor.fetchone()
+
+    if not admin or admin[0] != "Admin":
+        print("Access denied! Only Admins can rebalance shards.")
+        conn.close()
+        return
+
+    try:
+        cursor.execute("""CREATE TABLE IF NOT EXISTS shards (
+                              shard_id INTEGER PRIMARY KEY,
+                              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+        conn.commit()
+        old_count = _shard_count(conn)
+
+        for shard_id in range(shard_count):
+            _create_shard(shard_id)
+        if old_count == 0:
+            _ensure_expense_schema(DB_PATH)
+        for shard_id in range(max(old_count, shard_count)):
+            _ensure_expense_schema(_shard_path(shard_id))
+            cursor.execute(f"ATTACH DATABASE ? AS shard{shard_id}", (_shard_path(shard_id),))
+
+        # Before the first rebalance every expense is still in the catalog
+        sources = [f"shard{shard_id}" for shard_id in range(old_count)] if old_count else ["main"]
+        columns = ", ".join(EXPENSE_COLUMNS)
+        moved = 0
+
+        # All shards are attached to one connection, so the moves and the new
+        # shard map are committed in a single transaction
+        for source_id, source in enumerate(sources):
+            for target_id in range(shard_count):
+                if old_count and source_id == target_id:
+                    continue
+                # Keep expense_id when it already falls in the target's range
+                cursor.execute(f"""INSERT INTO shard{target_id}.expenses (expense_id, {columns})
+                                   SELECT CASE WHEN expense_id / ? = ? THEN expense_id END, {columns}
+                                   FROM {source}.expenses
+                                   WHERE user_id % ? = ?""",
+                               (SHARD_ID_SPAN, target_id, shard_count, target_id))
+                moved += cursor.rowcount
+                cursor.execute(f"""INSERT OR REPLACE INTO shard{target_id}.expense_sketches
+                                   SELECT * FROM {source}.expense_sketches WHERE user_id % ? = ?""",
+                               (shard_count, target_id))
+            for table in SHARDED_TABLES:
+                if not (old_count and source_id < shard_count):
+                    cursor.execute(f"DELETE FROM {source}.{table}")
+                elif table != "expense_rollups":
+                    cursor.execute(f"DELETE FROM {source}.{table} WHERE user_id % ? != ?",
+                                   (shard_count, source_id))
+        # Rollups span users, so each shard's are rebuilt from the sketches it now holds
+        for target_id in range(shard_count):
+            _rollup_rebuild(conn, schema=f"shard{target_id}")
+
+        cursor.execute("DELETE FROM shards")
+        cursor.executemany("INSERT INTO shards (shard_id) VALUES (?)",
+                           [(shard_id,) for shard_id in range(shard_count)])
+        # New shard map version, so a backup running meanwhile starts again
+        shard_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        cursor.execute(f"PRAGMA user_version = {shard_version + 1}")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Rebalance failed: {e}")
+        return
+    finally:
+        conn.close()
+
+    for shard_id in range(shard_count, old_count):
+        os.remove(_shard_path(shard_id))
+    print(f"Expenses rebalanced across {shard_count} shard(s); {moved} expense(s) moved.")
+
+# 27. Report Duplicate Expenses
+def report_duplicate_expenses(user_id, user_role):
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
+
+    # Only duplicates have a NULL fingerprint; each one is matched to the
+    # expense holding its fingerprint through the unique index
+    query = f"""SELECT d.expense_id, k.expense_id as duplicate_of, d.user_id, d.amount,
+                      c.name as category, d.date, d.description
+               FROM expenses d
+               JOIN expenses k ON k.fingerprint = expense_fingerprint(d.user_id, d.date, d.amount,
+                                                                      d.category_id, d.method_id, d.description)
+               JOIN categories c ON d.category_id = c.category_id
+               WHERE d.fingerprint IS NULL"""
+
+    params = []
+    if user_role != "Admin":
+        query += " AND d.user_id = ?"
+        params.append(user_id)
+
+    query += " ORDER BY duplicate_of, d.expense_id"
+
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    print("\nDuplicate expenses:")
+    print(df.to_string(index=False) if not df.empty else "No duplicate expenses found")
+
+def _report_filters(alias, user_id, user_role, category_name=None, month=None, month_column="month"):
+    where_clauses = []
+    params = []
+    if user_role != "Admin":
+        where_clauses.append(f"{alias}.user_id = ?")
+        params.append(user_id)
+    if category_name:
+        where_clauses.append("c.name = ?")
+        params.append(category_name)
+    if month:
+        where_clauses.append(f"{month_column} = ?")
+        params.append(month)
+    return (" WHERE " + " AND ".join(where_clauses) if where_clauses else ""), params
+
+# Sketches in scope as (category, month, sketch) rows: the user's own
+# sketches, or for admins the per-category rollups (one per shard)
+def _load_sketches(conn, user_id, user_role, category_name=None, month=None):
+    table = "expense_rollups" if user_role == "Admin" else "expense_sketches"
+    query = f"""SELECT c.name as category, s.month, s.expense_count, s.total,
+                       s.min_amount, s.max_amount, s.digest
+                FROM {table} s
+                JOIN categories c ON s.category_id = c.category_id"""
+    where, params = _report_filters("s", user_id, user_role, category_name, month, "s.month")
+    rows = conn.execute(query + where, params).fetchall()
+    return [(category, row_month, (count, total, min_amount, max_amount, json.loads(digest)))
+            for category, row_month, count, total, min_amount, max_amount, digest in rows]
+
+# Merge sketch rows sharing key(row), e.g. the same category across users and months
+def _merge_sketches(rows, key):
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row[2])
+    return {group: _sketch_merge(sketches) for group, sketches in sorted(groups.items())}
+
+# Raw amounts in scope, for the exact (validation) mode of the sketch reports
+def _load_amounts(conn, user_id, user_role, category_name=None, month=None):
+    query = """SELECT c.name as category, expense_month(e.date) as month, e.amount
+               FROM expenses e
+               JOIN categories c ON e.category_id = c.category_id"""
+    where, params = _report_filters("e", user_id, user_role, category_name, month,
+                                    "expense_month(e.date)")
+    # Like the sketches, leave out legacy dates that have no month
+    return pd.read_sql_query(query + where, conn, params=params).dropna(subset=["month"])
+
+# 28. Report Spending Percentiles by Category
+def report_spending_percentiles(user_id, user_role, month=None, exact=False):
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
+
+    if exact:
+        amounts = _load_amounts(conn, user_id, user_role, month=month)
+        rows = [[category, len(group)] + [_exact_quantile(group["amount"], q) for q in REPORT_QUANTILES]
+                for category, group in amounts.groupby("category")]
+    else:
+        sketches = _merge_sketches(_load_sketches(conn, user_id, user_role, month=month), lambda row: row[0])
+        rows = [[category, count] + [_digest_quantile(centroids, q, min_amount, max_amount)
+                                     for q in REPORT_QUANTILES]
+                for category, (count, _, min_amount, max_amount, centroids) in sketches.items()]
+    conn.close()
+
+    columns = ["category", "expense_count"] + [f"p{round(q * 100)}" for q in REPORT_QUANTILES]
+    df = pd.DataFrame(rows, columns=columns).round(2)
+
+    print(f"\nSpending percentiles by category ({'exact' if exact else 'sketch'})"
+          + (f" for {month}" if month else "") + ":")
+    print(df.to_string(index=False) if not df.empty else "No expenses found")
+
+# 29. Report Spending Distribution for a Category
+def report_spending_distribution(user_id, user_role, category_name, buckets=10, exact=False):
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
+
+    if exact:
+        amounts = sorted(_load_amounts(conn, user_id, user_role, category_name)["amount"])
+        conn.close()
+        if not amounts:
+            print(f"\nNo expenses found for '{category_name}'")
+            return
+        min_amount, max_amount = amounts[0], amounts[-1]
+        rank = lambda value: bisect.bisect_right(amounts, value)
+    else:
+        sketches = _merge_sketches(_load_sketches(conn, user_id, user_role, category_name), lambda row: row[0])
+        conn.close()
+        if not sketches:
+            print(f"\nNo expenses found for '{category_name}'")
+            return
+        _, _, min_amount, max_amount, centroids = sketches[category_name]
+        rank = lambda value: _digest_rank(centroids, value, min_amount, max_amount)
+
+    if max_amount == min_amount:
+        buckets = 1
+    width = (max_amount - min_amount) / buckets
+    edges = [min_amount + width * i for i in range(buckets)] + [max_amount]
+    # Buckets are (low, high], with the first one also holding min_amount
+    ranks = [0] + [rank(edge) for edge in edges[1:]]
+    total = ranks[-1]
+
+    df = pd.DataFrame({
+        "range": [f"{low:.2f} - {high:.2f}" for low, high in zip(edges, edges[1:])],
+        "expense_count": [round(high - low) for low, high in zip(ranks, ranks[1:])],
+        "share_%": [round((high - low) * 100 / total, 1) for low, high in zip(ranks, ranks[1:])],
+    })
+
+    print(f"\nSpending distribution for '{category_name}' ({'exact' if exact else 'sketch'}):")
+    print(df.to_string(index=False))
+
+# 30. Report Month-over-Month Spending Trend
+def report_monthly_trend(user_id, user_role, category_name=None, exact=False):
+    conn = connect_report_db(None if user_role == "Admin" else user_id)
+
+    if exact:
+        amounts = _load_amounts(conn, user_id, user_role, category_name)
+        rows = [[category, month, len(group), group["amount"].sum(), _exact_quantile(group["amount"], 0.5)]
+                for (category, month), group in amounts.groupby(["category", "month"])]
+    else:
+        sketches = _merge_sketches(_load_sketches(conn, user_id, user_role, category_name),
+                                   lambda row: (row[0], row[1]))
+        rows = [[category, month, count, total, _digest_quantile(centroids, 0.5, min_amount, max_amount)]
+                for (category, month), (count, total, min_amount, max_amount, centroids) in sketches.items()]
+    conn.close()
+
+    df = pd.DataFrame(rows, columns=["category", "month", "expense_count", "total_spending", "median"])
+    by_category = df.groupby("category")
+    # Compare only with the previous calendar month: after a month without
+    # spending in the category the change is left blank
+    month_index = df["month"].str[:4].astype(int) * 12 + df["month"].str[5:7].astype(int)
+    adjacent = month_index.groupby(df["category"]).diff() == 1
+    df["total_change_%"] = (by_category["total_spending"].pct_change() * 100).where(adjacent)
+    df["median_change_%"] = (by_category["median"].pct_change() * 100).where(adjacent)
+
+    print(f"\nMonth-over-month spending trend ({'exact' if exact else 'sketch'}):")
+    print(df.round(2).to_string(index=False) if not df.empty else "No expenses found")
+
 # Update the help menu to include reports
 def print_help():
     print("""
@@ -536,6 +1515,17 @@ REPORTS:
 21. Most frequent category
 22. Payment method usage
 23. Expenses by tag
+
+MAINTENANCE:
+24. Online backup (Admin only)
+25. Reporting snapshot (Admin only)
+26. Rebalance expense shards (Admin only)
+27. Duplicate expenses scan
+
+DISTRIBUTION REPORTS:
+28. Spending percentiles by category (median/p90/p99)
+29. Spending distribution for a category
+30. Month-over-month spending trend
 """)
 
 def get_input(prompt, password=False):
@@ -669,7 +1659,8 @@ if __name__ == "__main__":
 
             elif option == 14:  # Import from CSV
                 filename = get_input("Enter filename to import from: ")
-                import_expenses(filename)
+                mode = get_input("Duplicate handling (skip/upsert, default=skip): ").strip().lower() or "skip"
+                import_expenses(filename, mode)
 
             elif option == 15:  # Exit
                 break
@@ -732,8 +1723,78 @@ if __name__ == "__main__":
                     continue
                 report_tag_expenses(user_id, role)
 
+            elif option == 24:  # Online backup
+                if user_id is None or role != "Admin":
+                    print("Access denied! Admin only.")
+                    continue
+                filename = get_input("Enter backup filename (e.g., expense_backup.db): ")
+                backup_database(filename)
+
+            elif option == 25:  # Reporting snapshot
+                if user_id is None or role != "Admin":
+                    print("Access denied! Admin only.")
+                    continue
+                mode = get_input("Snapshot mode (refresh/auto/off, default=refresh): ").strip().lower() or "refresh"
+                if mode == "refresh":
+                    refresh_snapshot()
+                elif mode == "auto":
+                    try:
+                        interval = float(get_input("Refresh interval in minutes: "))
+                        if interval <= 0:
+                            raise ValueError
+                        start_snapshot_refresher(interval)
+                    except ValueError:
+                        print("Invalid interval!")
+                elif mode == "off":
+                    disable_snapshot_reports()
+                else:
+                    print("Invalid snapshot mode!")
+
+            elif option == 26:  # Rebalance shards
+                if user_id is None or role != "Admin":
+                    print("Access denied! Admin only.")
+                    continue
+                try:
+                    shard_count = int(get_input(f"Enter number of shards (1-{MAX_SHARDS}): "))
+                    rebalance_shards(user_id, shard_count)
+                except ValueError:
+                    print("Invalid shard count!")
+
+            elif option == 27:  # Duplicate expenses scan
+                if user_id is None:
+                    print("You must log in first!")
+                    continue
+                report_duplicate_expenses(user_id, role)
+
+            elif option in (28, 29, 30):  # Distribution reports
+                if user_id is None:
+                    print("You must log in first!")
+                    continue
+                try:
+                    if option == 28:
+                        month = get_input("Enter month (YYYY-MM) or leave blank for all: ") or None
+                        if month and not _is_iso_date(month + "-01"):  # Validate month format
+                            raise ValueError
+                    elif option == 29:
+                        category = get_input("Enter category name: ")
+                        buckets = int(get_input("Number of buckets (default=10): ") or 10)
+                        if buckets <= 0:
+                            raise ValueError
+                    else:
+                        category = get_input("Filter by category name (optional): ") or None
+                    exact = get_input("Exact mode for validation? (y/N): ").strip().lower() == "y"
+                except ValueError:
+                    print("Invalid input format!")
+                    continue
+                if option == 28:
+                    report_spending_percentiles(user_id, role, month, exact)
+                elif option == 29:
+                    report_spending_distribution(user_id, role, category, buckets, exact)
+                else:
+                    report_monthly_trend(user_id, role, category, exact)
+
             else:
                 print("Invalid option number. Type 'help' to see available options.")
         else:
-            print("Please enter a number (1-23) or 'help'. Type 'help' to see options.")
+            print("Please enter a number (1-30) or 'help'. Type 'help' to see options.")
                